@@ -1,7 +1,11 @@
 import os
+import re
 import json
-import requests
+import atexit
+import asyncio
+import aiohttp
 import sqlite3
+import numpy as np
 import pandas as pd
 from typing import TypedDict, List, Dict, Any, Optional
 from datetime import datetime, timezone
@@ -25,6 +29,27 @@ try:
 except ImportError:
     HAS_SUPABASE = False
 
+# Try importing hyperscan (SIMD multi-pattern matcher, preferred for vocabulary scans)
+try:
+    import hyperscan
+    HAS_HYPERSCAN = True
+except ImportError:
+    HAS_HYPERSCAN = False
+
+# Try importing sqlite-vec (vector distance functions for the plan cache)
+try:
+    import sqlite_vec
+    HAS_SQLITE_VEC = True
+except ImportError:
+    HAS_SQLITE_VEC = False
+
+# Try importing orjson (faster parsing of Gemini's JSON output)
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
 # Load environment variables
 load_dotenv()
 
@@ -36,6 +61,11 @@ GITHUB_API_BASE = "https://api.github.com"
 GITHUB_TOKEN = os.getenv('GITHUB_TOKEN')
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 
+# Built once; every GitHub request shares these
+GITHUB_HEADERS = {'Accept': 'application/vnd.github.v3+json'}
+if GITHUB_TOKEN:
+    GITHUB_HEADERS['Authorization'] = f'token {GITHUB_TOKEN}'
+
 # Supabase config
 SUPABASE_URL = os.getenv('SUPABASE_URL')
 SUPABASE_KEY = os.getenv('SUPABASE_KEY')
@@ -43,9 +73,28 @@ SUPABASE_KEY = os.getenv('SUPABASE_KEY')
 # SQLite fallback
 SQLITE_DB = 'pullshark.db'
 
+# Semantic plan cache: reuse a stored test plan when a PR's title and diff embed
+# within this cosine distance of a previous PR's in the same repo with the same risk score
+EMBEDDING_MODEL = 'models/text-embedding-004'
+PLAN_CACHE_MAX_DISTANCE = 0.05
+PLAN_CACHE_TTL = int(os.getenv('PLAN_CACHE_TTL', 7 * 24 * 3600))  # seconds
+
+# ETag-revalidated copies of GitHub responses older than this are dropped
+HTTP_CACHE_TTL = int(os.getenv('HTTP_CACHE_TTL', 7 * 24 * 3600))  # seconds
+
+# Risk is scored on the full diff; only this many characters are kept for the prompt
+MAX_DIFF_CHARS = 2000
+
+# Each keyword found in the PR title or diff adds 2 to the risk score (max 10)
+RISK_KEYWORDS = ['auth', 'payment', 'security', 'db', 'delete']
+RISK_PATTERN = re.compile('|'.join(map(re.escape, RISK_KEYWORDS)), re.IGNORECASE)
+
 # Test mode flag
 TEST_MODE = os.getenv('TEST_MODE', 'false').lower() == 'true'
 
+# Diff used for the mock PR in test mode
+MOCK_DIFF = '+ stripe.Charge.create(amount=100)\n+ if not token: raise Error'
+
 # Determine Database
 USE_SUPABASE = HAS_SUPABASE and SUPABASE_URL and SUPABASE_KEY
 DB_TYPE = 'supabase' if USE_SUPABASE else 'sqlite'
@@ -91,6 +140,70 @@ SAMPLE_BUGS = [
     }
 ]
 
+# ============================================================================
+# KNOWLEDGE BASE INDEX
+# ============================================================================
+
+# Tokens of 4 chars or fewer ("auth", "load", ...) are too generic to score on
+MIN_TOKEN_LEN = 5
+
+def _tokenize(text: str) -> frozenset:
+    """Lowercased scoring tokens of a text."""
+    return frozenset(token for token in re.findall(r"\w+", text.lower()) if len(token) >= MIN_TOKEN_LEN)
+
+def _build_term_matrix(token_sets: List[frozenset]) -> tuple:
+    """Builds the corpus vocabulary and an L2-normalized TF-IDF bug x term matrix over it."""
+    vocab = sorted(frozenset().union(*token_sets))
+    index = {token: j for j, token in enumerate(vocab)}
+    matrix = np.zeros((len(token_sets), len(vocab)), dtype=np.float32)
+    for i, tokens in enumerate(token_sets):
+        matrix[i, [index[token] for token in tokens]] = 1.0
+    
+    # Smoothed IDF, as in scikit-learn's TfidfVectorizer
+    doc_freq = matrix.sum(axis=0)
+    matrix *= np.log((1 + len(token_sets)) / (1 + doc_freq)) + 1
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix /= np.where(norms == 0, 1, norms)
+    return vocab, index, matrix
+
+# Built once at import so queries never touch the raw bug text
+BUG_TOKEN_SETS = [_tokenize(bug['issue_title'] + " " + bug['issue_description']) for bug in SAMPLE_BUGS]
+BUG_VOCAB, BUG_TERM_INDEX, BUG_TERM_MATRIX = _build_term_matrix(BUG_TOKEN_SETS)
+
+def _build_hyperscan_db(vocab: List[str]):
+    """Compiles the vocabulary into one Hyperscan database; pattern ids are vocab indices."""
+    # Hyperscan has no \b in Unicode mode, so word boundaries are checked on each match instead
+    db = hyperscan.Database()
+    db.compile(expressions=[re.escape(token).encode() for token in vocab],
+               ids=list(range(len(vocab))),
+               flags=[hyperscan.HS_FLAG_SOM_LEFTMOST] * len(vocab))
+    return db
+
+BUG_HS_DB = _build_hyperscan_db(BUG_VOCAB) if HAS_HYPERSCAN and BUG_VOCAB else None
+
+WORD_CHAR = re.compile(r"\w")
+
+def _is_whole_word(text: bytes, start: int, end: int) -> bool:
+    """True if the UTF-8 span text[start:end] has no word character on either side, as in _tokenize."""
+    before = text[max(0, start - 4):start].decode(errors='ignore')[-1:]
+    after = text[end:end + 4].decode(errors='ignore')[:1]
+    return not (WORD_CHAR.match(before) or WORD_CHAR.match(after))
+
+def _match_bug_tokens(query: str) -> set:
+    """Returns the corpus tokens occurring as whole words in the (lowercased) query."""
+    if BUG_HS_DB is not None:
+        data = query.encode()
+        hits = set()
+
+        def on_match(pattern_id, start, end, flags, ctx):
+            if _is_whole_word(data, start, end):
+                hits.add(pattern_id)
+
+        BUG_HS_DB.scan(data, match_event_handler=on_match)
+        return {BUG_VOCAB[i] for i in hits}
+    # Fallback: one set intersection against the vocabulary
+    return _tokenize(query) & BUG_TERM_INDEX.keys()
+
 def semantic_search_bugs(query_text: str, k: int = 3) -> List[Dict]:
     """
     Simulates a semantic search. 
@@ -98,32 +211,36 @@ def semantic_search_bugs(query_text: str, k: int = 3) -> List[Dict]:
     """
     print(f"🔍 Searching knowledge base for: '{query_text[:50]}...'")
     
-    keywords = set(query_text.lower().split())
-    results = []
+    # Relevance is the TF-IDF weight of the terms each bug shares with the query
+    query_vec = np.zeros(len(BUG_VOCAB), dtype=np.float32)
+    query_vec[[BUG_TERM_INDEX[token] for token in _match_bug_tokens(query_text.lower())]] = 1.0
+    scores = BUG_TERM_MATRIX @ query_vec
     
-    # Simple relevance scoring for demo purposes
-    for bug in SAMPLE_BUGS:
-        score = 0
-        text = (bug['issue_title'] + " " + bug['issue_description']).lower()
-        
-        for word in keywords:
-            if len(word) > 4 and word in text:
-                score += 1
-        
-        if score > 0:
-            bug_copy = bug.copy()
-            bug_copy['score'] = score
-            results.append(bug_copy)
-            
-    results = sorted(results, key=lambda x: x['score'], reverse=True)[:k]
+    k = min(k, len(scores))
+    if k <= 0:
+        return []
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = sorted((i for i in top if scores[i] > 0), key=lambda i: (-scores[i], i))
+    
+    results = []
+    for i in top:
+        bug_copy = SAMPLE_BUGS[i].copy()
+        bug_copy['score'] = round(float(scores[i]), 3)
+        results.append(bug_copy)
     return results
 
 # ============================================================================
 # DATABASE LAYER
 # ============================================================================
 
+# Kept as a constant so SQLite's statement cache reuses the compiled insert
+PR_ANALYSIS_INSERT = '''INSERT INTO pr_analyses (pr_number, repo, author, test_plan, status, risk_score, bugs_found, created_at)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)'''
+
 class Database:
     def __init__(self):
+        # Local SQLite connection, shared with the caches (None on Supabase)
+        self.conn = None
         if USE_SUPABASE:
             self.client: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
             print("✅ DB: Connected to Supabase")
@@ -132,8 +249,13 @@ class Database:
             print("✅ DB: Using Local SQLite")
     
     def _init_sqlite(self):
-        conn = sqlite3.connect(SQLITE_DB)
-        c = conn.cursor()
+        # One long-lived connection; autocommit, with explicit transactions for writes
+        self.conn = sqlite3.connect(SQLITE_DB, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('PRAGMA temp_store=MEMORY')
+        atexit.register(self.conn.close)
+        c = self.conn.cursor()
         
         # Create tables
         c.execute('''CREATE TABLE IF NOT EXISTS historical_prs 
@@ -143,8 +265,6 @@ class Database:
         c.execute('''CREATE TABLE IF NOT EXISTS pr_analyses 
                      (id INTEGER PRIMARY KEY, pr_number INTEGER, repo TEXT, author TEXT, 
                       test_plan TEXT, status TEXT, risk_score INTEGER, bugs_found INTEGER, created_at TIMESTAMP)''')
-        conn.commit()
-        conn.close()
     
     def get_historical_data(self, repo: str) -> List[Dict]:
         # Returns mock historical data for the demo
@@ -154,29 +274,117 @@ class Database:
         ]
 
     def log_analysis(self, record: Dict) -> bool:
+        return self.log_analyses([record])
+
+    def log_analyses(self, records: List[Dict]) -> bool:
         if USE_SUPABASE:
             try:
-                self.client.table('pr_analyses').insert(record).execute()
+                self.client.table('pr_analyses').insert(records).execute()
                 return True
             except Exception as e:
                 print(f"❌ Supabase Error: {e}")
                 return False
         else:
             try:
-                conn = sqlite3.connect(SQLITE_DB)
-                c = conn.cursor()
-                c.execute('''INSERT INTO pr_analyses (pr_number, repo, author, test_plan, status, risk_score, bugs_found, created_at)
-                             VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
-                          (record['pr_number'], record['repo'], record['author'], json.dumps(record['test_plan']),
-                           record['status'], record['risk_score'], record['pathway_bugs_found'], record['timestamp']))
-                conn.commit()
-                conn.close()
+                rows = [(record['pr_number'], record['repo'], record['author'], json.dumps(record['test_plan']),
+                         record['status'], record['risk_score'], record['pathway_bugs_found'], record['timestamp'])
+                        for record in records]
+                # All records land in a single transaction
+                self.conn.execute('BEGIN IMMEDIATE')
+                try:
+                    self.conn.executemany(PR_ANALYSIS_INSERT, rows)
+                except Exception:
+                    self.conn.execute('ROLLBACK')
+                    raise
+                self.conn.execute('COMMIT')
                 return True
             except Exception as e:
                 print(f"❌ SQLite Error: {e}")
                 return False
 
+class PlanCache:
+    """Semantic cache of generated test plans, kept in the local SQLite database."""
+
+    def __init__(self, conn: Optional[sqlite3.Connection]):
+        self.conn = None
+        if conn is None or not HAS_SQLITE_VEC:
+            return
+        try:
+            # Loaded onto the database's own connection, so the cache shares its WAL setup
+            conn.enable_load_extension(True)
+            sqlite_vec.load(conn)
+            conn.enable_load_extension(False)
+            # Cached plans are disposable: a table from before risk_score was keyed on is rebuilt
+            columns = [row[1] for row in conn.execute('PRAGMA table_info(plan_cache)')]
+            if columns and 'risk_score' not in columns:
+                conn.execute('DROP TABLE plan_cache')
+            conn.execute('''CREATE TABLE IF NOT EXISTS plan_cache 
+                            (id INTEGER PRIMARY KEY, repo TEXT, risk_score INTEGER, embedding BLOB, plan TEXT, ts INTEGER)''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_plan_cache_key ON plan_cache (repo, risk_score, ts)')
+            self.conn = conn
+        except Exception as e:
+            print(f"⚠️ Plan cache disabled: {e}")
+
+    @property
+    def enabled(self) -> bool:
+        return self.conn is not None
+
+    def lookup(self, repo: str, risk_score: int, embedding: List[float]) -> Optional[Dict]:
+        cutoff = int(datetime.now(timezone.utc).timestamp()) - PLAN_CACHE_TTL
+        row = self.conn.execute(
+            '''SELECT plan, vec_distance_cosine(embedding, ?) AS distance FROM plan_cache
+               WHERE repo = ? AND risk_score = ? AND ts > ? ORDER BY distance LIMIT 1''',
+            (sqlite_vec.serialize_float32(embedding), repo, risk_score, cutoff)).fetchone()
+        if row and row[1] < PLAN_CACHE_MAX_DISTANCE:
+            return json.loads(row[0])
+        return None
+
+    def store(self, repo: str, risk_score: int, embedding: List[float], plan: Dict):
+        now = int(datetime.now(timezone.utc).timestamp())
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            self.conn.execute('DELETE FROM plan_cache WHERE ts <= ?', (now - PLAN_CACHE_TTL,))
+            self.conn.execute(
+                'INSERT INTO plan_cache (repo, risk_score, embedding, plan, ts) VALUES (?, ?, ?, ?, ?)',
+                (repo, risk_score, sqlite_vec.serialize_float32(embedding), json.dumps(plan), now))
+        except Exception:
+            self.conn.execute('ROLLBACK')
+            raise
+        self.conn.execute('COMMIT')
+
+class HttpCache:
+    """ETag-tagged copies of GitHub responses, so unchanged resources come back as a bodyless 304."""
+
+    def __init__(self, conn: Optional[sqlite3.Connection]):
+        self.conn = conn
+        if conn is not None:
+            conn.execute('''CREATE TABLE IF NOT EXISTS http_cache 
+                            (key TEXT PRIMARY KEY, etag TEXT, body TEXT, ts INTEGER)''')
+
+    @property
+    def enabled(self) -> bool:
+        return self.conn is not None
+
+    def get(self, key: str) -> Optional[tuple]:
+        cutoff = int(datetime.now(timezone.utc).timestamp()) - HTTP_CACHE_TTL
+        return self.conn.execute('SELECT etag, body FROM http_cache WHERE key = ? AND ts > ?',
+                                 (key, cutoff)).fetchone()
+
+    def store(self, key: str, etag: str, body: str):
+        now = int(datetime.now(timezone.utc).timestamp())
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            self.conn.execute('DELETE FROM http_cache WHERE ts <= ?', (now - HTTP_CACHE_TTL,))
+            self.conn.execute('INSERT OR REPLACE INTO http_cache (key, etag, body, ts) VALUES (?, ?, ?, ?)',
+                              (key, etag, body, now))
+        except Exception:
+            self.conn.execute('ROLLBACK')
+            raise
+        self.conn.execute('COMMIT')
+
 db = Database()
+plan_cache = PlanCache(db.conn)
+http_cache = HttpCache(db.conn)
 
 # ============================================================================
 # STATE MANAGEMENT
@@ -196,18 +404,77 @@ class PullSharkState(TypedDict):
     test_plan: Dict
     formatted_comment: str
     status: str
+    no_cache: bool
+
+# Response schema Gemini is constrained to when generating a test plan.
+# Written out rather than derived from a TypedDict: the SDK's conversion drops `required`.
+_STRING_LIST = {'type': 'array', 'items': {'type': 'string'}}
+TEST_PLAN_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'edge_cases': _STRING_LIST,
+        'security_risks': _STRING_LIST,
+        'recommended_tests': _STRING_LIST,
+        'priority': {'type': 'string', 'enum': ['High', 'Medium', 'Low']},
+    },
+    'required': ['edge_cases', 'security_risks', 'recommended_tests', 'priority'],
+}
 
 # ============================================================================
 # WORKFLOW NODES
 # ============================================================================
 
-def get_github_headers():
-    return {
-        'Authorization': f'token {GITHUB_TOKEN}',
-        'Accept': 'application/vnd.github.v3+json'
-    }
+def score_risk(title: str, diff: str) -> int:
+    # One case-insensitive scan per text instead of lowercasing the diff per keyword
+    hits = {m.lower() for text in (title, diff) for m in RISK_PATTERN.findall(text)}
+    return min(2 * len(hits), 10)
+
+def github_session() -> aiohttp.ClientSession:
+    """Keep-alive session for the GitHub API with the auth headers applied once."""
+    return aiohttp.ClientSession(
+        headers=GITHUB_HEADERS,
+        connector=aiohttp.TCPConnector(limit=30, limit_per_host=10, ttl_dns_cache=300, keepalive_timeout=30),
+    )
+
+async def fetch_github(session: aiohttp.ClientSession, url: str, accept: Optional[str] = None) -> str:
+    """GET a GitHub resource, revalidating any cached copy with If-None-Match."""
+    # Auth and the default Accept header are set once on the session
+    headers = {}
+    if accept:
+        headers['Accept'] = accept
+    
+    # The cache calls below are blocking sqlite on the event loop; they are single-row
+    # lookups against a local file, far cheaper than the request they avoid
+    key = f"{accept or ''} {url}"
+    cached = http_cache.get(key) if http_cache.enabled else None
+    if cached:
+        headers['If-None-Match'] = cached[0]
+    
+    async with session.get(url, headers=headers) as res:
+        if res.status == 304 and cached:
+            return cached[1]
+        res.raise_for_status()
+        body = await res.text()
+        if http_cache.enabled and res.headers.get('ETag'):
+            http_cache.store(key, res.headers['ETag'], body)
+        return body
+
+async def fetch_pr_diff(session: aiohttp.ClientSession, pr_url: str) -> str:
+    """The PR's unified diff, degrading to per-file patches and then to an empty diff instead of failing."""
+    try:
+        return await fetch_github(session, pr_url, accept='application/vnd.github.v3.diff')
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        # GitHub answers 406 when the diff exceeds its line/file limits
+        print(f"   ⚠️ Diff unavailable ({e}), falling back to per-file patches")
+    
+    try:
+        files = json.loads(await fetch_github(session, f"{pr_url}/files?per_page=100"))
+        return '\n'.join(f"+++ b/{f['filename']}\n{f.get('patch', '')}" for f in files)
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, KeyError, TypeError) as e:
+        print(f"   ⚠️ Per-file patches unavailable ({e}), continuing without the diff")
+        return ''
 
-def extract_pr_data(repo: str, pr_number: int) -> PullSharkState:
+async def extract_pr_data(session: aiohttp.ClientSession, repo: str, pr_number: int) -> PullSharkState:
     print(f"\n📥 [1/5] Fetching PR Data for {repo}#{pr_number}...")
     
     # Demo Mode Fallback
@@ -219,27 +486,21 @@ def extract_pr_data(repo: str, pr_number: int) -> PullSharkState:
             'pr_description': 'Implements stripe charge logic and token validation.',
             'author': 'dev_user',
             'repo': repo,
-            'diff_content': '+ stripe.Charge.create(amount=100)\n+ if not token: raise Error',
+            'diff_content': MOCK_DIFF,
             'risk_score': 8,
             'timestamp': datetime.now(timezone.utc).isoformat(),
-            'similar_bugs': [], 'historical_prs': [], 'test_plan': {}, 'formatted_comment': '', 'status': 'pending'
+            'similar_bugs': [], 'historical_prs': [], 'test_plan': {}, 'formatted_comment': '', 'status': 'pending',
+            'no_cache': False
         }
 
     try:
-        # Fetch PR
+        # Fetch PR and Diff concurrently; only a failed PR fetch is fatal
         pr_url = f"{GITHUB_API_BASE}/repos/{repo}/pulls/{pr_number}"
-        pr_res = requests.get(pr_url, headers=get_github_headers())
-        pr_res.raise_for_status()
-        pr_data = pr_res.json()
-
-        # Fetch Diff
-        diff_url = f"{GITHUB_API_BASE}/repos/{repo}/pulls/{pr_number}.diff"
-        diff_res = requests.get(diff_url, headers=get_github_headers())
-        diff_content = diff_res.text
-
-        # Simple Risk Calc
-        keywords = ['auth', 'payment', 'security', 'db', 'delete']
-        risk = sum(2 for kw in keywords if kw in pr_data['title'].lower() or kw in diff_content.lower())
+        pr_body, diff_content = await asyncio.gather(
+            fetch_github(session, pr_url),
+            fetch_pr_diff(session, pr_url),
+        )
+        pr_data = json.loads(pr_body)
 
         return {
             'pr_number': pr_data['number'],
@@ -247,10 +508,12 @@ def extract_pr_data(repo: str, pr_number: int) -> PullSharkState:
             'pr_description': pr_data['body'] or '',
             'author': pr_data['user']['login'],
             'repo': repo,
-            'diff_content': diff_content[:2000], # Truncate for context window
-            'risk_score': min(risk, 10),
+            'diff_content': diff_content[:MAX_DIFF_CHARS], # Truncate for context window
+            'risk_score': score_risk(pr_data['title'], diff_content),
             'timestamp': datetime.now(timezone.utc).isoformat(),
-            'similar_bugs': [], 'historical_prs': [], 'test_plan': {}, 'formatted_comment': '', 'status': 'pending'
+            'similar_bugs': [], 'historical_prs': [], 'test_plan': {}, 'formatted_comment': '', 'status': 'pending',
+            # Security-labeled PRs always get a fresh plan
+            'no_cache': any('security' in label['name'].lower() for label in pr_data.get('labels', []))
         }
     except Exception as e:
         print(f"❌ Error fetching GitHub data: {e}")
@@ -269,6 +532,39 @@ def augment_context(state: PullSharkState) -> PullSharkState:
     print(f"   ✅ Found {len(state['similar_bugs'])} relevant past bugs")
     return state
 
+GEMINI_MODEL = 'gemini-2.5-flash'
+
+# Fixed instructions go in the system instruction, so each request only carries the PR-specific slots
+TEST_PLAN_PREAMBLE = """
+Act as a Senior QA Engineer. Create a JSON test plan for the Pull Request you are given.
+
+Return ONLY valid JSON with these keys:
+- edge_cases (list of strings)
+- security_risks (list of strings)
+- recommended_tests (list of strings)
+- priority (High/Medium/Low)
+"""
+
+TEST_PLAN_PROMPT = """PR Title: {pr_title}
+Risk Score: {risk_score}/10
+Diff Summary: {diff_summary}...
+
+Known Bugs in similar code:
+{similar_bugs}
+"""
+
+_MODEL = None
+
+def _get_model() -> genai.GenerativeModel:
+    """Configures the SDK and builds the Gemini model once, reusing its client on later calls."""
+    global _MODEL
+    if _MODEL is None:
+        genai.configure(api_key=GEMINI_API_KEY)
+        _MODEL = genai.GenerativeModel(GEMINI_MODEL, system_instruction=TEST_PLAN_PREAMBLE,
+                                       generation_config={'response_mime_type': 'application/json',
+                                                          'response_schema': TEST_PLAN_SCHEMA})
+    return _MODEL
+
 def generate_test_plan(state: PullSharkState) -> PullSharkState:
     print(f"\n🤖 [3/5] Generating Test Plan with Gemini...")
     
@@ -277,38 +573,60 @@ def generate_test_plan(state: PullSharkState) -> PullSharkState:
         state['test_plan'] = {'error': 'No API Key'}
         return state
 
-    genai.configure(api_key=GEMINI_API_KEY)
-    model = genai.GenerativeModel('gemini-2.5-flash')
-    
-    prompt = f"""
-    Act as a Senior QA Engineer. Create a JSON test plan for this Pull Request.
+    model = _get_model()
     
-    PR Title: {state['pr_title']}
-    Risk Score: {state['risk_score']}/10
-    Diff Summary: {state['diff_content'][:500]}...
+    diff_summary = state['diff_content'][:500]
+    prompt = TEST_PLAN_PROMPT.format(
+        pr_title=state['pr_title'],
+        risk_score=state['risk_score'],
+        diff_summary=diff_summary,
+        similar_bugs=json.dumps(state['similar_bugs'], indent=2),
+    )
     
-    Known Bugs in similar code:
-    {json.dumps(state['similar_bugs'], indent=2)}
-    
-    Return ONLY valid JSON with these keys:
-    - edge_cases (list of strings)
-    - security_risks (list of strings)
-    - recommended_tests (list of strings)
-    - priority (High/Medium/Low)
-    """
+    # Semantic cache: skip the LLM call when a near-identical PR was answered before.
+    # Only the PR's own title and diff are embedded; the known-bugs block is shared by
+    # unrelated PRs and would pull them under the distance threshold.
+    embedding = None
+    if plan_cache.enabled and not state.get('no_cache'):
+        try:
+            embedding = genai.embed_content(model=EMBEDDING_MODEL, content=f"{state['pr_title']}\n{diff_summary}",
+                                            task_type='semantic_similarity')['embedding']
+            cached_plan = plan_cache.lookup(state['repo'], state['risk_score'], embedding)
+            if cached_plan is not None:
+                print("   ⚡ Reusing cached test plan for a similar PR")
+                state['test_plan'] = cached_plan
+                state['status'] = 'success'
+                return state
+        except Exception as e:
+            print(f"   ⚠️ Plan cache lookup failed: {e}")
     
     try:
-        response = model.generate_content(prompt, generation_config={'response_mime_type': 'application/json'})
-        state['test_plan'] = json.loads(response.text)
+        response = model.generate_content(prompt)
+        state['test_plan'] = orjson.loads(response.text) if HAS_ORJSON else json.loads(response.text)
         state['status'] = 'success'
     except Exception as e:
         print(f"❌ Gemini Error: {e}")
         state['test_plan'] = {"error": "Generation failed"}
         state['status'] = 'failed'
+    
+    # A failed cache write must not discard a good plan
+    if embedding is not None and state['status'] == 'success':
+        try:
+            plan_cache.store(state['repo'], state['risk_score'], embedding, state['test_plan'])
+        except Exception as e:
+            print(f"   ⚠️ Plan cache store failed: {e}")
         
     return state
 
-def post_comment(state: PullSharkState) -> PullSharkState:
+# Static parts of the PR comment; the body is assembled with a single join
+COMMENT_HEADER = "## 🦈 PullShark AI Analysis\n"
+COMMENT_TESTS_HEADING = "\n### 🧪 Recommended Tests"
+COMMENT_RISKS_HEADING = "\n### ⚠️ Edge Cases & Security"
+COMMENT_FOOTER = "\n---\n*Generated by PullShark using Gemini & Pathway*"
+_CHECKBOX_FMT = "- [ ] {}".format
+_BULLET_FMT = "- {}".format
+
+async def post_comment(session: aiohttp.ClientSession, state: PullSharkState) -> PullSharkState:
     print(f"\n📝 [4/5] Formatting & Posting Comment...")
     
     plan = state.get('test_plan', {})
@@ -318,26 +636,23 @@ def post_comment(state: PullSharkState) -> PullSharkState:
         
     priority_emoji = "🔴" if plan.get('priority') == 'High' else "🟡"
     
-    comment = f"""## 🦈 PullShark AI Analysis
-    
-**Risk Level**: {priority_emoji} {plan.get('priority', 'Unknown')}
-
-### 🧪 Recommended Tests
-{chr(10).join(f"- [ ] {t}" for t in plan.get('recommended_tests', []))}
-
-### ⚠️ Edge Cases & Security
-{chr(10).join(f"- {t}" for t in plan.get('edge_cases', []) + plan.get('security_risks', []))}
-
----
-*Generated by PullShark using Gemini & Pathway*
-    """
+    comment = "\n".join([
+        COMMENT_HEADER,
+        f"**Risk Level**: {priority_emoji} {plan.get('priority', 'Unknown')}",
+        COMMENT_TESTS_HEADING,
+        *map(_CHECKBOX_FMT, plan.get('recommended_tests', [])),
+        COMMENT_RISKS_HEADING,
+        *map(_BULLET_FMT, plan.get('edge_cases', [])),
+        *map(_BULLET_FMT, plan.get('security_risks', [])),
+        COMMENT_FOOTER,
+    ])
     state['formatted_comment'] = comment
     
     if not TEST_MODE and GITHUB_TOKEN:
         try:
             url = f"{GITHUB_API_BASE}/repos/{state['repo']}/issues/{state['pr_number']}/comments"
-            res = requests.post(url, json={'body': comment}, headers=get_github_headers())
-            res.raise_for_status()
+            async with session.post(url, json={'body': comment}) as res:
+                res.raise_for_status()
             print("   ✅ Comment posted to GitHub")
         except Exception as e:
             print(f"   ❌ Failed to post comment: {e}")
@@ -363,6 +678,16 @@ def save_results(state: PullSharkState):
     db.log_analysis(record)
     print("✅ Workflow Complete!")
 
+async def workflow(repo: str, pr_number: int) -> PullSharkState:
+    # One pooled session for every GitHub call in the run
+    async with github_session() as session:
+        state = await extract_pr_data(session, repo, pr_number)
+        state = augment_context(state)
+        state = generate_test_plan(state)
+        state = await post_comment(session, state)
+    save_results(state)
+    return state
+
 # ============================================================================
 # MAIN ENTRY POINT
 # ============================================================================
@@ -378,11 +703,7 @@ if __name__ == "__main__":
     
     try:
         # Run Workflow
-        state = extract_pr_data(target_repo, target_pr)
-        state = augment_context(state)
-        state = generate_test_plan(state)
-        state = post_comment(state)
-        save_results(state)
+        state = asyncio.run(workflow(target_repo, target_pr))
         
         print("\n--- Final Output ---")
         print(state['formatted_comment'])
@@ -7,10 +7,11 @@ from pathway.udfs import DefaultCache
 from pathway.udfs import ExponentialBackoffRetryStrategy
 from pathway.xpacks.llm.question_answering import BaseRAGQuestionAnswerer
 from pathway.stdlib.indexing import UsearchKnnFactory, USearchMetricKind
-from pathway.xpacks.llm import embedders, llms, parsers, splitters
+from pathway.xpacks.llm import llms, parsers, splitters
 from pathway.xpacks.llm.document_store import DocumentStore
 
 from data.connector.githubConnector import GitHubIssueScraperSubject
+from data.embedder.batchedGeminiEmbedder import BatchedGeminiEmbedder
 
 # Pathway License
 pw.set_license_key("demo-license-key-with-telemetry")
@@ -54,8 +55,11 @@ def run():
     )
 
     # ------------------ EMBEDDING MODEL ------------------
-    embedder = embedders.GeminiEmbedder(
-        model="models/text-embedding-004"
+    # Batches concurrent chunk embeddings into one Gemini request
+    embedder = BatchedGeminiEmbedder(
+        model="models/text-embedding-004",
+        batch_size=100,
+        max_delay_ms=50,
     )
 
     # ------------------ VECTOR INDEX ------------------
@@ -3,6 +3,12 @@ from pathway.io.python import ConnectorSubject
 from data.source.issueScraper import scrapIssues
 import asyncio
 
+# uvloop's libuv-based loop cuts per-request overhead for the scraper's fan-out
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
 
 class GitHubIssueScraperSubject(ConnectorSubject):
 
@@ -12,7 +18,7 @@ class GitHubIssueScraperSubject(ConnectorSubject):
 
     def run(self) -> None:
 
-        loop = asyncio.new_event_loop()
+        loop = uvloop.new_event_loop() if uvloop else asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
         data = loop.run_until_complete(scrapIssues(self._scrap_link))
         loop.close()
@@ -26,23 +32,18 @@ class GitHubIssueScraperSubject(ConnectorSubject):
             comments = issue["comments"]
             diffs = issue["code_diff"]
 
-            comments_txt = "\n".join(
+            # Built in one pass: comment and diff lines go straight into the
+            # parts list, with no intermediate joined strings
+            parts = [f"Issue ID: {issue_id}", f"Title: {title}", "", body or "", "", "Comments:"]
+            parts.extend(
                 f"[{c.get('user',{}).get('login','unknown')}] {c.get('body','')}"
                 for c in comments
             )
+            parts += ["", "Code Diff:"]
+            for d in diffs:
+                parts += [f"--- {d.get('path','')} ---", d.get('diff','')]
 
-            diff_txt = "\n".join(
-                f"--- {d.get('path','')} ---\n{d.get('diff','')}"
-                for d in diffs
-            )
-
-            final_text = (
-                f"Issue ID: {issue_id}\n"
-                f"Title: {title}\n\n"
-                f"{body}\n\n"
-                f"Comments:\n{comments_txt}\n\n"
-                f"Code Diff:\n{diff_txt}"
-            )
+            final_text = "\n".join(parts)
 
             url = f"https://github.com/{repo}/issues/{issue_id}"
                 
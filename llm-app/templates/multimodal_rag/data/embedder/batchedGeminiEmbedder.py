@@ -0,0 +1,117 @@
+import asyncio
+import hashlib
+from collections import Counter, OrderedDict
+
+import numpy as np
+import google.generativeai as genai
+from pathway.xpacks.llm import embedders
+from pathway.xpacks.llm._utils import _extract_value_inside_dict
+
+# Gemini rejects batchEmbedContents requests with more than 100 inputs
+GEMINI_MAX_BATCH = 100
+
+# Embeddings kept for near-duplicate reuse (least recently used are evicted)
+MAX_CACHED_EMBEDDINGS = 10_000
+
+
+# 64-bit SimHash over the chunk's token counts and token bigrams.
+# Bigrams make it order-sensitive, but it is still a near-duplicate hash:
+# chunks that differ in only a few tokens can share a fingerprint, and
+# then share one embedding. That aliasing is intended.
+def simhash(text, bits=64):
+    tokens = text.lower().split()
+    features = Counter(tokens)
+    features.update(f"{a} {b}" for a, b in zip(tokens, tokens[1:]))
+
+    weights = [0] * bits
+    for feature, count in features.items():
+        h = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "big")
+        for i in range(bits):
+            weights[i] += count if (h >> i) & 1 else -count
+
+    return sum(1 << i for i, w in enumerate(weights) if w > 0)
+
+
+class BatchedGeminiEmbedder(embedders.GeminiEmbedder):
+    """
+    GeminiEmbedder that coalesces concurrent per-chunk calls into batched requests.
+
+    Pending chunks are sent in one embed_content call once `batch_size` of them
+    are queued or `max_delay_ms` has passed. Chunks with the same SimHash
+    fingerprint reuse an embedding instead of being sent again. Constructor and
+    per-call Gemini arguments (model, api_key, task_type, ...) are honored; only
+    chunks with the same arguments share a batch.
+    """
+
+    def __init__(self, *, batch_size=GEMINI_MAX_BATCH, max_delay_ms=50, capacity=None, **kwargs):
+        # Capacity below the batch size would never let a batch fill up
+        super().__init__(capacity=capacity or batch_size, **kwargs)
+        self._batch_size = min(batch_size, GEMINI_MAX_BATCH)
+        self._max_delay = max_delay_ms / 1000
+        self._embeddings = OrderedDict()
+        self._inflight = {}
+        self._pending = {}
+        self._flush_handle = None
+        self._tasks = set()
+
+    async def __wrapped__(self, input: str, **kwargs) -> np.ndarray:
+        kwargs = _extract_value_inside_dict({**self.kwargs, **kwargs})
+        group = repr(sorted(kwargs.items()))
+        key = (group, simhash(input))
+        if key in self._embeddings:
+            self._embeddings.move_to_end(key)
+            return self._embeddings[key]
+
+        future = self._inflight.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._inflight[key] = future
+            _, batch = self._pending.setdefault(group, (kwargs, []))
+            batch.append((input, key))
+
+            if len(batch) >= self._batch_size:
+                self._flush()
+            elif self._flush_handle is None:
+                self._flush_handle = loop.call_later(self._max_delay, self._flush)
+
+        return await asyncio.shield(future)
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        pending, self._pending = self._pending, {}
+        for kwargs, chunks in pending.values():
+            for i in range(0, len(chunks), self._batch_size):
+                # Keep a reference so the task isn't garbage collected mid-request
+                task = asyncio.ensure_future(self._embed_batch(chunks[i:i + self._batch_size], kwargs))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    def _remember(self, key, vector):
+        self._embeddings[key] = vector
+        if len(self._embeddings) > MAX_CACHED_EMBEDDINGS:
+            self._embeddings.popitem(last=False)
+
+    async def _embed_batch(self, batch, kwargs):
+        kwargs = dict(kwargs)
+        model = kwargs.pop("model", None)
+        api_key = kwargs.pop("api_key", None)
+
+        try:
+            if api_key is not None:
+                genai.configure(api_key=api_key)
+            response = await asyncio.to_thread(
+                genai.embed_content, model, content=[text for text, _ in batch], **kwargs
+            )
+        except Exception as e:
+            for _, key in batch:
+                self._inflight.pop(key).set_exception(e)
+            return
+
+        for (_, key), embedding in zip(batch, response["embedding"]):
+            vector = np.array(embedding)
+            self._remember(key, vector)
+            self._inflight.pop(key).set_result(vector)
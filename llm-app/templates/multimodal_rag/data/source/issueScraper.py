@@ -1,24 +1,38 @@
 import aiohttp
 import asyncio
+import contextvars
+import hashlib
 import os
+import time
+
+import orjson
+import zstandard
 
 GITHUB = "https://api.github.com"
 
 # Read personal access token
 GITHUB_PAT = os.getenv("GITHUB_PAT")
 
+# Scraped issues are kept here between runs (data/ is a mounted volume)
+ISSUE_CACHE_DIR = os.getenv("ISSUE_CACHE_DIR", "data/cache")
+
+# A cached scrape is never reused after this long, even if nothing changed
+ISSUE_CACHE_MAX_AGE = int(os.getenv("ISSUE_CACHE_MAX_AGE", 24 * 3600))
+
+# URLs whose fetch failed during the current scrape (shared by all its tasks)
+failed_urls = contextvars.ContextVar("failed_urls", default=None)
+
 
-def github_headers():
-    headers = {"Accept": "application/vnd.github+json"}
-    if GITHUB_PAT:
-        headers["Authorization"] = f"Bearer {GITHUB_PAT}"
-    return headers
+# Built once and set on the session, so no request rebuilds them
+GITHUB_HEADERS = {"Accept": "application/vnd.github+json"}
+if GITHUB_PAT:
+    GITHUB_HEADERS["Authorization"] = f"Bearer {GITHUB_PAT}"
 
 
-# General function to fetch any API
-async def fetch_json(session, url):
+# General function to fetch any API (appends the response ETag to `etags` if given)
+async def fetch_json(session, url, etags=None):
     try:
-        async with session.get(url, headers=github_headers()) as resp:
+        async with session.get(url) as resp:
             # Rate limit
             if resp.status == 403:
                 reset = resp.headers.get("X-RateLimit-Reset")
@@ -26,23 +40,32 @@ async def fetch_json(session, url):
                     now = int(asyncio.get_event_loop().time())
                     wait = int(reset) - now
                     await asyncio.sleep(max(wait, 2))
-                    return await fetch_json(session, url)
+                    return await fetch_json(session, url, etags)
             resp.raise_for_status()
-            return await resp.json()
+            if etags is not None:
+                etags.append(resp.headers.get("ETag"))
+            return orjson.loads(await resp.read())
     except Exception as e:
         print("ERROR:", url, e)
+        failures = failed_urls.get()
+        if failures is not None:
+            failures.append(url)
         return {}
 
 
-# Fetch closed issues (150 with pagination)
+def listing_url(scrapLink, page):
+    return f"{scrapLink}?state=closed&per_page=100&page={page}"
+
+
+# Fetch closed issues (150 with pagination), plus the ETag of every page fetched
 async def fetch_closed_issues(session, scrapLink):
     all_issues = []
+    etags = []
     page = 1
 
     # Keep fetching until we have at least 150 issues
     while len(all_issues) < 150:
-        url = f"{scrapLink}?state=closed&per_page=100&page={page}"
-        issues = await fetch_json(session, url)
+        issues = await fetch_json(session, listing_url(scrapLink, page), etags)
 
         if not isinstance(issues, list) or len(issues) == 0:
             break
@@ -55,7 +78,7 @@ async def fetch_closed_issues(session, scrapLink):
 
         page += 1
 
-    return all_issues[:150]
+    return all_issues[:150], etags
 
 
 
@@ -96,23 +119,16 @@ async def fetch_comments(session, url):
     return data if isinstance(data, list) else []
 
 
-# Process single issue
-async def process_issue(session, issue, scrapLink):
-    issue_id = issue["number"]
-    repo = scrapLink.split("repos/")[1].split("/issues")[0]
-
-    closing_sha_task = asyncio.create_task(
-        fetch_closing_sha(session, issue["events_url"])
+# Closing commit SHA and comments of a single issue, fetched together
+async def fetch_issue_context(session, issue):
+    return await asyncio.gather(
+        fetch_closing_sha(session, issue["events_url"]),
+        fetch_comments(session, issue["comments_url"]),
     )
 
-    comments_task = asyncio.create_task(
-        fetch_comments(session, issue["comments_url"])
-    )
-
-    closing_sha = await closing_sha_task
-    diffs = await fetch_commit_diff(session, repo, closing_sha)
-    comments = await comments_task
 
+# Build the record for a single issue
+def process_issue(issue, repo, comments, diffs):
     return {
         "issue_id": issue.get("number"),
         "title": issue.get("title", ""),
@@ -135,19 +151,86 @@ async def process_issue(session, issue, scrapLink):
 
 
 
+# Conditional HEAD on one listing page (no body is transferred)
+async def page_unchanged(session, url, etag):
+    try:
+        async with session.head(url, headers={"If-None-Match": etag}) as resp:
+            return resp.status == 304
+    except Exception as e:
+        print("ERROR:", url, e)
+        return False
+
+
+# True only if every listing page the cached scrape was built from is unchanged
+async def listing_unchanged(session, scrapLink, etags):
+    if not etags:
+        return False
+
+    unchanged = await asyncio.gather(*(
+        page_unchanged(session, listing_url(scrapLink, page), etag)
+        for page, etag in enumerate(etags, start=1)
+    ))
+    return all(unchanged)
+
+
+# Compressed copy of the last scrape, tagged with its listing pages' ETags
+def issue_cache_path(scrapLink):
+    name = hashlib.sha1(scrapLink.encode()).hexdigest()[:16]
+    return os.path.join(ISSUE_CACHE_DIR, f"{name}.json.zst")
+
+
+def load_issue_cache(scrapLink):
+    try:
+        with open(issue_cache_path(scrapLink), "rb") as f:
+            return orjson.loads(zstandard.decompress(f.read()))
+    except (OSError, zstandard.ZstdError, orjson.JSONDecodeError):
+        return None
+
+
+def save_issue_cache(scrapLink, etags, issues):
+    os.makedirs(ISSUE_CACHE_DIR, exist_ok=True)
+    payload = orjson.dumps({"etags": etags, "saved_at": time.time(), "issues": issues})
+    with open(issue_cache_path(scrapLink), "wb") as f:
+        f.write(zstandard.ZstdCompressor().compress(payload))
+
+
 # Main function
 async def scrapIssues(scrapLink) -> list:
     conn = aiohttp.TCPConnector(limit=30)
-
-    async with aiohttp.ClientSession(connector=conn) as session:
-        issues = await fetch_closed_issues(session, scrapLink)
-        
-        tasks = [
-            process_issue(session, issue, scrapLink)
+    cache = load_issue_cache(scrapLink)
+    failures = []
+    failed_urls.set(failures)
+
+    async with aiohttp.ClientSession(connector=conn, headers=GITHUB_HEADERS) as session:
+        # Recent cache and unchanged listing: skip re-scraping every issue
+        if (
+            cache
+            and time.time() - cache.get("saved_at", 0) < ISSUE_CACHE_MAX_AGE
+            and await listing_unchanged(session, scrapLink, cache.get("etags"))
+        ):
+            print("Issues unchanged since last scrape, using cache")
+            return cache["issues"]
+
+        issues, etags = await fetch_closed_issues(session, scrapLink)
+        repo = scrapLink.split("repos/")[1].split("/issues")[0]
+
+        # Stage 1: closing SHAs and comments for every issue
+        contexts = await asyncio.gather(*(
+            fetch_issue_context(session, issue)
             for issue in issues
+        ))
+
+        # Stage 2: all commit diffs at once, instead of each one waiting
+        # behind its own issue's SHA lookup
+        diffs = await asyncio.gather(*(
+            fetch_commit_diff(session, repo, sha)
+            for sha, _ in contexts
+        ))
+
+        results = [
+            process_issue(issue, repo, comments, issue_diffs)
+            for issue, (_, comments), issue_diffs in zip(issues, contexts, diffs)
         ]
-
-        results = await asyncio.gather(*tasks)
         if not results:
             return [{
                 "issue_id": "no-data",
@@ -158,4 +241,10 @@ async def scrapIssues(scrapLink) -> list:
                 "repo": scrapLink.split("repos/")[1].split("/issues")[0],
             }]
 
+        # A partial scrape (failed or rate-limited fetches) must not be replayed later
+        if failures:
+            print(f"{len(failures)} fetches failed, not caching this scrape")
+        elif all(etags):
+            save_issue_cache(scrapLink, etags, results)
+
         return results